@@ -1,28 +1,220 @@
+from contextlib import asynccontextmanager, nullcontext
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import requests
+from pydantic import BaseModel, Field
+from starlette.middleware.cors import ALL_METHODS
+import asyncio
+import bisect
+import httpx
 import csv
-import json
-import random
-from mangum import Mangum
+import io
+import itertools
+import logging
+import os
+import time
+from typing import Annotated, Any, Callable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+def create_client():
+    return httpx.AsyncClient(
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+        ),
+        timeout=5,
+        follow_redirects=True,  # Sheet exports redirect to googleusercontent.com
+    )
+
+# Shared HTTP client for the sheet exports; keeps connections to docs.google.com alive between requests.
+# Shutdown closes it, so startup opens a new one if the app is started again in the same process.
+client = create_client()
+
+@asynccontextmanager
+async def lifespan(app):
+    global client
+    if client.is_closed:
+        client = create_client()
+    # Load every sheet before serving (this also opens the pooled connections), then keep them fresh
+    await load_all_sheets()
+    # With caching disabled every request fetches anyway, so there is nothing to keep warm
+    refresher = asyncio.create_task(refresh_sheets()) if SHEET_CACHE_TTL > 0 else None
+    yield
+    if refresher:
+        refresher.cancel()
+    await client.aclose()
 
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+
+# CORS policy, shared by CORSMiddleware and the preflight shortcut below
+CORS_ALLOW_ORIGINS = ["*"]
+CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_METHODS = ["*"]
+CORS_ALLOW_HEADERS = ["*"]
+CORS_MAX_AGE = 600  # seconds a browser may reuse a preflight answer (Starlette's default)
 
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  
-    allow_credentials=True,
-    allow_methods=["*"],  
-    allow_headers=["*"],  
+    allow_origins=CORS_ALLOW_ORIGINS,
+    allow_credentials=CORS_ALLOW_CREDENTIALS,
+    allow_methods=CORS_ALLOW_METHODS,
+    allow_headers=CORS_ALLOW_HEADERS,
+    max_age=CORS_MAX_AGE,
 )
 
+# The shortcut approves every preflight it answers, so it is only correct for an allow-everything policy.
+# Narrowing any of these must go through CORSMiddleware's checks instead.
+if (CORS_ALLOW_ORIGINS, CORS_ALLOW_METHODS, CORS_ALLOW_HEADERS) != (["*"], ["*"], ["*"]):
+    raise RuntimeError("PreflightShortCircuit requires wildcard CORS origins, methods and headers")
+
+# Preflight headers for the CORS policy above, built once at import, matching what CORSMiddleware sends
+_PREFLIGHT_HEADERS = [
+    (b"access-control-allow-methods", ", ".join(ALL_METHODS).encode()),
+    (b"access-control-max-age", str(CORS_MAX_AGE).encode()),
+    (b"vary", b"Origin, Access-Control-Request-Method, Access-Control-Request-Headers, Access-Control-Request-Private-Network"),
+]
+if CORS_ALLOW_CREDENTIALS:
+    _PREFLIGHT_HEADERS.append((b"access-control-allow-credentials", b"true"))
+else:
+    _PREFLIGHT_HEADERS.append((b"access-control-allow-origin", b"*"))
+
+class PreflightShortCircuit:
+    # Answers CORS preflights with the static headers above before they reach CORSMiddleware.
+    # Anything CORSMiddleware would reject (unknown method, private network access) is passed on to it.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope["headers"])
+        origin = request_headers.get(b"origin")
+        requested_method = request_headers.get(b"access-control-request-method")
+        if (
+            origin is None
+            or requested_method is None
+            or requested_method.decode("latin-1") not in ALL_METHODS
+            or b"access-control-request-private-network" in request_headers
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = list(_PREFLIGHT_HEADERS)
+        if CORS_ALLOW_CREDENTIALS:
+            # With credentials a wildcard origin is not allowed, so the request's origin is echoed
+            headers.append((b"access-control-allow-origin", origin))
+        requested_headers = request_headers.get(b"access-control-request-headers")
+        if requested_headers is not None:
+            headers.append((b"access-control-allow-headers", requested_headers))
+
+        await send({"type": "http.response.start", "status": 204, "headers": headers})
+        await send({"type": "http.response.body", "body": b""})
+
+# Added last so it runs first
+app.add_middleware(PreflightShortCircuit)
+
 # URLs for assessment data
 PHQ9_URL = "https://docs.google.com/spreadsheets/d/1D312sgbt_nOsT668iaUrccAzQ3oByUT0peXS8LYL5wg/export?format=csv"
 ASQ_URL = "https://docs.google.com/spreadsheets/d/1TiU8sv5cJg30ZL3fqPSmBwJJbB7h2xv1NNbKo4ZIydU/export?format=csv"
 BAI_URL = "https://docs.google.com/spreadsheets/d/1f7kaFuhCv6S_eX4EuIrlhZFDR7W5MhQpJSXHznlpJEk/export?format=csv"
 
+# Only the answer and name columns of the ASQ sheet are used
+ASQ_COLUMNS = (2, 5, -4, -3, -2, -1)
+
+def parse_sheet(content, columns=None):
+    # Yields the data rows of a CSV export as lists of strings, header excluded.
+    # If given, `columns` lists the (possibly negative) column indexes to keep.
+    text = content.decode("utf-8")
+    # Google quotes question headers that contain commas, so only the data rows decide the parser.
+    # A quoted newline inside the header leaves a quote in `body`, which keeps csv.reader in charge.
+    _, _, body = text.partition("\n")
+    if '"' in body:
+        reader = csv.reader(io.StringIO(text, newline=""))
+        next(reader, None)  # Skip header
+    else:
+        # No data row is quoted, so every comma separates fields and every newline ends a row
+        reader = (line.split(",") for line in body.replace("\r\n", "\n").split("\n") if line)
+    if columns is None:
+        return reader
+
+    # Rows too short to hold every requested column are skipped rather than failing the sheet
+    min_width = max(i + 1 if i >= 0 else -i for i in columns)
+    return ([row[i] for i in columns] for row in reader if len(row) >= min_width)
+
+# In-process cache of parsed sheets, keyed by URL. Each sheet maps a casefolded full name to the
+# record its tool's prepare function built from that row.
+SHEET_CACHE_TTL = float(os.environ.get("SHEET_CACHE_TTL", 60))  # seconds; 0 disables caching
+if SHEET_CACHE_TTL < 0:
+    raise ValueError(f"SHEET_CACHE_TTL must be >= 0, got {SHEET_CACHE_TTL}")
+SHEET_REFRESH_INTERVAL = max(SHEET_CACHE_TTL * 0.8, 1)  # Refresh before entries expire, at most once a second
+SHEET_RETRY_AFTER = 5  # seconds a stale sheet is served after a failed reload before requests retry it
+_CSV_CACHE: dict[str, tuple[float, dict[str, object]]] = {}
+_CSV_CACHE_LOCKS: dict[str, asyncio.Lock] = {}
+# Conditional request headers (If-None-Match / If-Modified-Since) for the cached copy of each sheet
+_CSV_VALIDATORS: dict[str, dict[str, str]] = {}
+
+def make_name_key(name_parts):
+    # Sheet rows and requests are both keyed through here so their lookups always agree
+    return " ".join(name_parts).strip().casefold()
+
+async def load_sheet(url, prepare, columns=None):
+    # Fetches and indexes a sheet, then swaps it into the cache in a single assignment
+    cached = _CSV_CACHE.get(url)
+    response = await client.get(url, headers=_CSV_VALIDATORS.get(url) if cached else None)
+    if cached and response.status_code == 304:
+        # Unchanged since the last load: keep the parsed index and restart its TTL
+        _CSV_CACHE[url] = (time.monotonic(), cached[1])
+        return cached[1]
+    response.raise_for_status()
+
+    index = {}
+    for row in parse_sheet(response.content, columns):
+        if len(row) < 4:
+            continue
+        name_key = make_name_key(row[-4:])
+        if name_key not in index:  # Keep the first submission, as the old scan did
+            index[name_key] = prepare(row)
+
+    validators = {}
+    if "ETag" in response.headers:
+        validators["If-None-Match"] = response.headers["ETag"]
+    if "Last-Modified" in response.headers:
+        validators["If-Modified-Since"] = response.headers["Last-Modified"]
+
+    _CSV_CACHE[url] = (time.monotonic(), index)
+    _CSV_VALIDATORS[url] = validators
+    return index
+
+async def get_sheet(url, prepare, columns=None, ttl=SHEET_CACHE_TTL):
+    cached = _CSV_CACHE.get(url)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    # One lock per URL so concurrent misses share a single fetch and the three sheets still load in parallel.
+    # With caching disabled every request fetches anyway, so they do not queue behind each other.
+    lock = _CSV_CACHE_LOCKS.setdefault(url, asyncio.Lock()) if ttl > 0 else nullcontext()
+    async with lock:
+        cached = _CSV_CACHE.get(url)
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        try:
+            return await load_sheet(url, prepare, columns)
+        except Exception as e:
+            if not cached:
+                raise
+            # Serve the expired copy rather than fail the request. It counts as fresh for SHEET_RETRY_AFTER
+            # seconds, so waiting requests get it at once instead of each retrying the fetch in turn;
+            # the background refresher keeps retrying meanwhile.
+            logger.warning("Could not reload sheet %s, serving the cached copy: %s", url, e)
+            if _CSV_CACHE.get(url) is cached:  # Unless a concurrent load already replaced it
+                _CSV_CACHE[url] = (time.monotonic() - ttl + SHEET_RETRY_AFTER, cached[1])
+            return cached[1]
+
 # Response mappings
 response_mapping_phq9 = {
     "Not at all": 0,
@@ -38,26 +230,191 @@ response_mapping_bai = {
     "Severely - it bothered me a lot": 3
 }
 
+# Scoring: map + sum run in C instead of a per-response Python generator
+def score_responses(responses, mapping):
+    return sum(map(mapping.get, map(str.strip, responses), itertools.repeat(0)))
+
+# Interpretation bands: a score up to and including each threshold falls in the matching label
+PHQ9_THRESHOLDS = (4, 9, 14, 19)
+PHQ9_LABELS = (
+    "Minimal or none (0-4)",
+    "Mild (5-9)",
+    "Moderate (10-14)",
+    "Moderately severe (15-19)",
+    "Severe (20-27)",
+)
+
+BAI_THRESHOLDS = (21, 35)
+BAI_LABELS = (
+    "Low Anxiety (0-21)",
+    "Moderate Anxiety (22-35)",
+    "Severe Anxiety (36+)",
+)
+
 # Interpretation functions
 def get_phq9_interpretation(score):
-    if score <= 4:
-        return "Minimal or none (0-4)"
-    elif score <= 9:
-        return "Mild (5-9)"
-    elif score <= 14:
-        return "Moderate (10-14)"
-    elif score <= 19:
-        return "Moderately severe (15-19)"
-    else:
-        return "Severe (20-27)"
+    return PHQ9_LABELS[bisect.bisect_left(PHQ9_THRESHOLDS, score)]
 
 def get_bai_interpretation(score):
-    if score <= 21:
-        return "Low Anxiety (0-21)"
-    elif score <= 35:
-        return "Moderate Anxiety (22-35)"
-    else:
-        return "Severe Anxiety (36+)"
+    return BAI_LABELS[bisect.bisect_left(BAI_THRESHOLDS, score)]
+
+# Prepare functions: run once per row when a sheet is loaded, keeping only what analysis needs
+def prepare_phq9(row):
+    return score_responses(row[1:-4], response_mapping_phq9)
+
+def prepare_asq(row):
+    selected_options = tuple(option.strip() for option in row[0].strip().split(","))
+    return selected_options, row[1].strip()
+
+def prepare_bai(row):
+    return score_responses(row[1:-4], response_mapping_bai)
+
+# Static response payloads, shared by every request that lands in the same outcome
+PHQ9_MILD_LABELS = PHQ9_LABELS[:2]
+PHQ9_MILD = {
+    "primary_impression": "The client may have mild or no mental health concerns.",
+    "additional_impressions": (),
+    "tool_recommendations": (),
+}
+PHQ9_SEVERE = {
+    "primary_impression": "The client might be experiencing more significant mental health concerns.",
+    "additional_impressions": (
+        "The analysis suggests the client might be experiencing Depression.",
+        "Physical symptoms may be affecting the client.",
+        "The client's overall well-being might require attention."
+    ),
+    "tool_recommendations": (
+        "Tools for Depression",
+        "Tools for Physical Symptoms",
+        "Tools for Well-Being"
+    ),
+}
+
+ASQ_NO_RISK = {
+    "interpretation": "No Risk",
+    "primary_impression": "The client has no risk of suicidal thoughts or behaviors.",
+    "additional_impressions": (),
+    "suggested_tools": (),
+}
+ASQ_ACUTE = {
+    "interpretation": "Acute Positive Screen",
+    "primary_impression": "The client is at imminent risk of suicide and requires immediate safety and mental health evaluation.",
+    "additional_impressions": ("The client requires a STAT safety/full mental health evaluation.",),
+    "suggested_tools": ("Tools for Suicide", "Immediate Mental Health Safety Plan"),
+}
+
+BAI_LOW = {
+    "primary_impression": "The client may have mild or no anxiety concerns.",
+    "additional_impressions": (),
+    "tool_recommendations": (),
+}
+BAI_ELEVATED = {
+    "primary_impression": "The client might be experiencing anxiety or related concerns.",
+    "additional_impressions": (
+        "Further evaluation may be needed for Anxiety symptoms.",
+        "Symptoms of Trauma or PTSD were noted.",
+        "Youth Mental Health factors may require attention."
+    ),
+    "tool_recommendations": (
+        "Tools for Anxiety",
+        "Tools for Trauma & PTSD",
+        "Tools for Youth Mental Health"
+    ),
+}
+
+# Analysis functions: each turns a client's prepared record into its section of the /analyze response
+def analyze_phq9(total_score, client_name):
+    interpretation = get_phq9_interpretation(total_score)
+    payload = PHQ9_MILD if interpretation in PHQ9_MILD_LABELS else PHQ9_SEVERE
+
+    return {
+        "client_name": client_name,
+        "total_score": total_score,
+        "interpretation": interpretation,
+        **payload
+    }
+
+def analyze_asq(record, client_name):
+    selected_options, acuity_response = record
+    payload = ASQ_ACUTE if "Yes" in acuity_response else ASQ_NO_RISK
+
+    return {
+        "client_name": client_name,
+        "selected_options": selected_options,
+        "acuity_response": acuity_response,
+        **payload
+    }
+
+def analyze_bai(total_score, client_name):
+    interpretation = get_bai_interpretation(total_score)
+    payload = BAI_LOW if interpretation == BAI_LABELS[0] else BAI_ELEVATED
+
+    return {
+        "client_name": client_name,
+        "total_score": total_score,
+        "interpretation": interpretation,
+        **payload
+    }
+
+# Assessment table, in response order
+class Tool(NamedTuple):
+    key: str
+    url: str
+    columns: tuple | None
+    prepare: Callable
+    analyze: Callable
+
+TOOLS = (
+    Tool("phq9", PHQ9_URL, None, prepare_phq9, analyze_phq9),
+    Tool("asq", ASQ_URL, ASQ_COLUMNS, prepare_asq, analyze_asq),
+    Tool("bai", BAI_URL, None, prepare_bai, analyze_bai),
+)
+
+async def load_all_sheets():
+    # Reloads every sheet; a failed load leaves that sheet's cached copy (if any) in place
+    results = await asyncio.gather(
+        *(load_sheet(tool.url, tool.prepare, tool.columns) for tool in TOOLS), return_exceptions=True
+    )
+    for tool, result in zip(TOOLS, results):
+        if isinstance(result, Exception):
+            logger.warning("Could not refresh the %s sheet: %s", tool.key, result)
+
+async def refresh_sheets():
+    # Background task: keeps the cache warm so requests do not wait on Google Sheets
+    while True:
+        await asyncio.sleep(SHEET_REFRESH_INTERVAL)
+        await load_all_sheets()
+
+async def get_all_sheets():
+    # Loads (or reuses) every tool's sheet at once, in TOOLS order; any fetch or parse failure is a 500
+    try:
+        return await asyncio.gather(*(get_sheet(tool.url, tool.prepare, tool.columns) for tool in TOOLS))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing data: {e}")
+
+def analyze_client(indexes, first_name, last_name, middle_name="", suffix=""):
+    # Builds the /analyze response for one client from the loaded sheets; empty if they are in none
+    input_name = f"{first_name} {middle_name} {last_name} {suffix}".strip()
+    name_key = make_name_key((first_name, middle_name, last_name, suffix))
+
+    results = {}
+    for tool, index in zip(TOOLS, indexes):
+        record = index.get(name_key)
+        if record is not None:
+            results[tool.key] = tool.analyze(record, input_name.title())
+    return results
+
+# Most clients one /analyze/batch request may hold; larger batches get a 422 so one request cannot tie up the worker
+MAX_BATCH_SIZE = 100
+
+# Declared return types let FastAPI serialise responses straight to JSON bytes through Pydantic
+AnalyzeResponse = dict[str, dict[str, Any]]
+
+class ClientName(BaseModel):
+    first_name: str
+    last_name: str
+    middle_name: str = ""
+    suffix: str = ""
 
 @app.get("/")
 def root():
@@ -68,129 +425,25 @@ def health_check():
     return {"status": "ok", "message": "API is running and accessible."}
 
 @app.get("/analyze")
-def analyze_assessments(first_name: str, last_name: str, middle_name: str = "", suffix: str = ""):
-    input_name = f"{first_name} {middle_name} {last_name} {suffix}".strip()
-    
-    try:
-        results = {}
-
-        # PHQ-9 Analysis
-        response = requests.get(PHQ9_URL)
-        response.raise_for_status()
-        data = response.text.splitlines()
-        reader = csv.reader(data)
-        next(reader)  # Skip header
-
-        for row in reader:
-            row_name = f"{row[-4]} {row[-3]} {row[-2]} {row[-1]}".strip()
-            if row_name.lower() == input_name.lower():
-                responses = row[1:-4]
-                total_score = sum(response_mapping_phq9.get(r.strip(), 0) for r in responses)
-                interpretation = get_phq9_interpretation(total_score)
-
-                primary_impression = (
-                    "The client may have mild or no mental health concerns."
-                    if interpretation in ["Minimal or none (0-4)", "Mild (5-9)"]
-                    else "The client might be experiencing more significant mental health concerns."
-                )
-
-                additional_impressions = [
-                    "The analysis suggests the client might be experiencing Depression.",
-                    "Physical symptoms may be affecting the client.",
-                    "The client's overall well-being might require attention."
-                ] if interpretation not in ["Minimal or none (0-4)", "Mild (5-9)"] else []
-
-                tool_recommendations = [
-                    "Tools for Depression",
-                    "Tools for Physical Symptoms",
-                    "Tools for Well-Being"
-                ] if interpretation not in ["Minimal or none (0-4)", "Mild (5-9)"] else []
-
-                results["phq9"] = {
-                    "client_name": input_name.title(),
-                    "total_score": total_score,
-                    "interpretation": interpretation,
-                    "primary_impression": primary_impression,
-                    "additional_impressions": additional_impressions,
-                    "tool_recommendations": tool_recommendations
-                }
-                break
-
-        # ASQ Analysis
-        response = requests.get(ASQ_URL)
-        response.raise_for_status()
-        data = response.text.splitlines()
-        reader = csv.reader(data)
-        next(reader)  # Skip header
-
-        for row in reader:
-            row_name = f"{row[-4]} {row[-3]} {row[-2]} {row[-1]}".strip()
-            if row_name.lower() == input_name.lower():
-                selected_options = [option.strip() for option in row[2].strip().split(",")]
-                acuity_response = row[5].strip()
-
-                interpretation = "No Risk"
-                primary_impression = "The client has no risk of suicidal thoughts or behaviors."
-                additional_impressions = []
-                suggested_tools = []
-
-                if "Yes" in acuity_response:
-                    interpretation = "Acute Positive Screen"
-                    primary_impression = "The client is at imminent risk of suicide and requires immediate safety and mental health evaluation."
-                    additional_impressions = ["The client requires a STAT safety/full mental health evaluation."]
-                    suggested_tools = ["Tools for Suicide", "Immediate Mental Health Safety Plan"]
-
-                results["asq"] = {
-                    "client_name": input_name.title(),
-                    "selected_options": selected_options,
-                    "acuity_response": acuity_response,
-                    "interpretation": interpretation,
-                    "primary_impression": primary_impression,
-                    "additional_impressions": additional_impressions,
-                    "suggested_tools": suggested_tools
-                }
-                break
-
-        # BAI Analysis
-        response = requests.get(BAI_URL)
-        response.raise_for_status()
-        data = response.text.splitlines()
-        reader = csv.reader(data)
-        next(reader)  # Skip header
-
-        for row in reader:
-            row_name = f"{row[-4]} {row[-3]} {row[-2]} {row[-1]}".strip()
-            if row_name.lower() == input_name.lower():
-                responses = row[1:-4]
-                total_score = sum(response_mapping_bai.get(r.strip(), 0) for r in responses)
-                interpretation = get_bai_interpretation(total_score)
-
-                primary_impression = "The client may have mild or no anxiety concerns." if interpretation == "Low Anxiety (0-21)" else "The client might be experiencing anxiety or related concerns."
-                additional_impressions = [
-                    "Further evaluation may be needed for Anxiety symptoms.",
-                    "Symptoms of Trauma or PTSD were noted.",
-                    "Youth Mental Health factors may require attention."
-                ] if interpretation != "Low Anxiety (0-21)" else []
-
-                tool_recommendations = [
-                    "Tools for Anxiety",
-                    "Tools for Trauma & PTSD",
-                    "Tools for Youth Mental Health"
-                ] if interpretation != "Low Anxiety (0-21)" else []
-
-                results["bai"] = {
-                    "client_name": input_name.title(),
-                    "total_score": total_score,
-                    "interpretation": interpretation,
-                    "primary_impression": primary_impression,
-                    "additional_impressions": additional_impressions,
-                    "tool_recommendations": tool_recommendations
-                }
-                break
-
-        return results
+async def analyze_assessments(first_name: str, last_name: str, middle_name: str = "", suffix: str = "") -> AnalyzeResponse:
+    results = analyze_client(await get_all_sheets(), first_name, last_name, middle_name, suffix)
+    if not results:
+        input_name = f"{first_name} {middle_name} {last_name} {suffix}".strip()
+        raise HTTPException(status_code=404, detail=f"No assessments found for {input_name.title()}.")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing data: {e}")
+    return results
+
+@app.post("/analyze/batch")
+async def analyze_batch(clients: Annotated[list[ClientName], Field(max_length=MAX_BATCH_SIZE)]) -> list[AnalyzeResponse]:
+    # One entry per client, in request order; a client found in no sheet gets an empty object
+    indexes = await get_all_sheets()
+    return [
+        analyze_client(indexes, client.first_name, client.last_name, client.middle_name, client.suffix)
+        for client in clients
+    ]
+
+# Run uvicorn directly; on Lambda this sits behind the Lambda Web Adapter, which forwards to $PORT
+if __name__ == "__main__":
+    import uvicorn
 
-handler = Mangum(app)
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))